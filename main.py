@@ -1,14 +1,26 @@
 import math
+import os
 import random
 
+import numpy as np
 import pygame
+from numba import njit
 
+# batched polygon drawing is only present in some pygame builds
+_HAS_DRAW_POLYGONS = hasattr(pygame.draw, "polygons")
 
-def rand_sample_between(min_val, max_val):
-    return random.random() * (max_val - min_val) + min_val
+# gfxdraw rasterizes small filled polygons much faster than draw.polygon,
+# but is an optional pygame module
+try:
+    import pygame.gfxdraw
+    _HAS_GFXDRAW = True
+except ImportError:
+    _HAS_GFXDRAW = False
 
 
 class Point:
+    __slots__ = ('x', 'y')
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -16,9 +28,14 @@ class Point:
     def transform(self, dist, rotation):
         """Return a new Point after moving float dist in the float rotation direction.
         """
+        return self.transform_cached(dist, math.cos(rotation), math.sin(rotation))
+
+    def transform_cached(self, dist, cs, sn):
+        """Like transform, but reuses an already-computed cos/sin pair.
+        """
         return Point(
-            x = dist * math.cos(rotation) + self.x,
-            y = dist * math.sin(rotation) + self.y
+            x = dist * cs + self.x,
+            y = dist * sn + self.y
         )
 
     def to_tuple(self):
@@ -26,6 +43,8 @@ class Point:
 
 
 class Color:
+    __slots__ = ('r', 'g', 'b', 'a')
+
     def __init__(self, r, g, b, a):
         self.r = r
         self.g = g
@@ -77,156 +96,306 @@ class Config:
         self.curve_resolution = curve_resolution
 
 
-class Circle:
-    def __init__(self, origin_x, origin_y, radius):
-        self.origin_x = origin_x
-        self.origin_y = origin_y
-        self.radius = radius
-
-    def get_angle(self, point):
-        dx = point.x - self.origin_x
-        ang = math.atan((point.y - self.origin_y)/dx)
-        if dx < 0:
-            ang += math.pi
-        return ang
-
-    def sample_points_between(self, p1, p2, resolution):
-        ang1 = self.get_angle(p1)
-        ang2 = self.get_angle(p2)
-        if ang2 < ang1:
-            ang2 += math.pi * 2
-        dang = ang2 - ang1
-        return [self.query(i/resolution * dang + ang1) for i in range(1, resolution)]
-
-
-    def query(self, angle):
-        return (
-            self.origin_x + self.radius * math.cos(angle),
-            self.origin_y + self.radius * math.sin(angle)
-        )
+def sample_bezier_between(p0, control, p2, ts):
+    """Evaluates the quadratic Bezier from p0 to p2 at every t in ts.
 
-    @staticmethod
-    def from_3_points(p1, p2, p3):
-        factor_12 = Circle.calculate_factor(p1, p2)
-        factor_13 = Circle.calculate_factor(p1, p3)
-        dx_ratios = (p1.x - p3.x) / (p1.x - p2.x)
-        origin_y = (factor_13 - factor_12 * dx_ratios) / (
-            p1.y - p3.y - dx_ratios * (p1.y - p2.y)
-        )
-        origin_x = (factor_12 - (p1.y - p2.y) * origin_y) / (p1.x - p2.x)
-        radius = math.sqrt((p1.x - origin_x) ** 2 + (p1.y - origin_y) ** 2)
-        return Circle(origin_x, origin_y, radius)
+    The points are (N, 2) arrays, one row per branch; returns an (N, len(ts), 2)
+    array of curve samples.
+    """
+    omt = 1 - ts
+    return (
+        omt[None, :, None] ** 2 * p0[:, None, :]
+        + 2 * (omt * ts)[None, :, None] * control[:, None, :]
+        + ts[None, :, None] ** 2 * p2[:, None, :]
+    )
+
+
+# initial record capacity for Branch.grow; doubled on overflow
+_MAX_NODES = 1 << 16
+
+# depth granularity of the shared branch-color table
+_COLOR_DEPTH_STEP = 0.05
+
+
+@njit(cache=True)
+def seed_tree_rng(seed):
+    """Seeds the build kernel's RNG for reproducible trees.
+
+    The kernel draws from Numba's internal NumPy random state, which
+    random.seed and np.random.seed do not touch.
+    """
+    np.random.seed(seed)
+
+
+@njit(cache=True)
+def _grow_records(
+    buf, count, sx, sy, rot, length, base_thickness, depth, parent,
+    thickness_decay, num_child_lo, num_child_hi, min_thickness, min_length,
+    length_decay_lo, length_decay_hi, rotation_lo, rotation_hi, depth_lo, depth_hi
+):
+    """Recursively fills buf with (sx, sy, rot, length, base_thickness, depth,
+    parent_index) rows, one per branch, and returns the number of rows written.
+    """
+    if count >= buf.shape[0]:
+        return count
+    index = count
+    buf[index, 0] = sx
+    buf[index, 1] = sy
+    buf[index, 2] = rot
+    buf[index, 3] = length
+    buf[index, 4] = base_thickness
+    buf[index, 5] = depth
+    buf[index, 6] = parent
+    count += 1
+
+    end_thickness = base_thickness * thickness_decay
+    end_x = sx + length * math.cos(rot)
+    end_y = sy + length * math.sin(rot)
+    num_children = np.random.randint(num_child_lo, num_child_hi + 1)
+    for _ in range(num_children):
+        child_length = length * np.random.uniform(length_decay_lo, length_decay_hi)
+        if end_thickness > min_thickness and child_length > min_length:
+            count = _grow_records(
+                buf, count, end_x, end_y,
+                rot + np.random.uniform(rotation_lo, rotation_hi),
+                child_length, end_thickness,
+                depth + np.random.uniform(depth_lo, depth_hi),
+                index,
+                thickness_decay, num_child_lo, num_child_hi, min_thickness,
+                min_length, length_decay_lo, length_decay_hi,
+                rotation_lo, rotation_hi, depth_lo, depth_hi
+            )
+    return count
 
-    @staticmethod
-    def calculate_factor(p1, p2):
-        return ((p1.x ** 2 - p2.x ** 2) + (p1.y ** 2 - p2.y ** 2)) / 2
+
+# released Branch objects waiting to be reused by Branch.acquire
+_BRANCH_POOL = []
 
 
 class Branch:
-    def __init__(self, base_thickness, length, starting_point, rotation, config, depth=0):
-        self.base_thickness = base_thickness
-        self.length = length
-        self.starting_point = starting_point
-        self.rotation = rotation
-        self.config = config
-        self.depth = depth
+    __slots__ = (
+        'base_thickness', 'length', 'starting_point', 'rotation', 'config',
+        'depth', 'end_thickness', 'mid_thickness', 'end_point', 'children',
+        '_draw_list'
+    )
 
-        # precomputed values
-        self.end_thickness = base_thickness * config.thickness_decay
-        self.mid_thickness = self.end_thickness * config.mid_thickness_multiplier
-        self.end_point = self.starting_point.transform(dist=length, rotation=rotation)
+    @classmethod
+    def grow(cls, base_thickness, length, starting_point, rotation, config):
+        """Builds a full tree by running the compiled recursion over flat
+        float records, then wrapping the records in Branch objects.
+        """
+        max_nodes = _MAX_NODES
+        while True:
+            buf = np.empty((max_nodes, 7), dtype=np.float64)
+            # coerce to float so the kernel always compiles for one signature;
+            # int arguments would trigger a second overload of the recursive
+            # function, which Numba cannot handle
+            count = _grow_records(
+                buf, 0,
+                float(starting_point.x), float(starting_point.y),
+                float(rotation), float(length),
+                float(base_thickness), 0.0, -1,
+                float(config.thickness_decay),
+                config.num_child_range[0], config.num_child_range[1],
+                float(config.min_thickness), float(config.min_length),
+                float(config.child_length_decay[0]), float(config.child_length_decay[1]),
+                float(config.rotation_range[0]), float(config.rotation_range[1]),
+                float(config.depth_range[0]), float(config.depth_range[1])
+            )
+            if count < max_nodes:
+                break
+            # buffer may have truncated the tree; rebuild with more room
+            max_nodes *= 2
+
+        branches = []
+        for record in buf[:count]:
+            branch = cls.acquire(
+                base_thickness=record[4],
+                length=record[3],
+                starting_point=Point(x=record[0], y=record[1]),
+                rotation=record[2],
+                config=config,
+                depth=record[5]
+            )
+            parent = int(record[6])
+            if parent >= 0:
+                branches[parent].children.append(branch)
+            branches.append(branch)
+        return branches[0]
+
+    @classmethod
+    def acquire(cls, base_thickness, length, starting_point, rotation, config, depth=0):
+        """Returns a pooled Branch if one is available, else a new one.
+        """
+        if _BRANCH_POOL:
+            branch = _BRANCH_POOL.pop()
+            branch._reset(base_thickness, length, starting_point, rotation, config, depth)
+            return branch
+        return cls(base_thickness, length, starting_point, rotation, config, depth)
 
-        # recursive child branches
+    def __init__(self, base_thickness, length, starting_point, rotation, config, depth=0):
+        # child branches, attached by grow()
         self.children = []
-        self._recurse()
+        self._reset(base_thickness, length, starting_point, rotation, config, depth)
+
+    def release_tree(self):
+        """Returns this branch and all its descendants to the pool.
+        """
+        for child in self.children:
+            child.release_tree()
+        self.children.clear()
+        _BRANCH_POOL.append(self)
 
     def render(self, surface):
-        # draw branches in the back first, then work way up to front
-        todo = sorted(self._breadth_first_collect([]), key=lambda branch: -branch.depth)
-        for branch in todo:
-            branch._render(surface)
+        # the tree is frozen once grown, so the geometry is built on the
+        # first render and replayed on every one after
+        if self._draw_list is None:
+            self._draw_list = self._build_geometry()
+
+        if _HAS_DRAW_POLYGONS:
+            # one C call amortizes argument parsing and surface locking
+            pygame.draw.polygons(surface, self._draw_list)
+            return
+
+        # hold the surface lock across the loop so each draw call
+        # skips its own lock/unlock round trip
+        surface.lock()
+        try:
+            if _HAS_GFXDRAW:
+                # note the flipped argument order; alpha is dropped because
+                # gfxdraw blends it instead of ignoring it like draw.polygon
+                for color_tuple, polygon_points, _ in self._draw_list:
+                    pygame.gfxdraw.filled_polygon(surface, polygon_points, color_tuple[:3])
+            else:
+                for color_tuple, polygon_points, _ in self._draw_list:
+                    pygame.draw.polygon(surface, color_tuple, polygon_points)
+        finally:
+            surface.unlock()
 
     # PRIVATE
 
-    def _breadth_first_collect(self, result):
-        result.append(self)
-        for child in self.children:
-            child._breadth_first_collect(result)
-        return result
-
-    def _render(self, surface):
-        """Renders a single branch.
+    def _build_geometry(self):
+        """Computes the (color, points, width) draw list for the whole tree,
+        already ordered back to front.
         """
-        base_rite = self.starting_point.transform(
-            dist=self.base_thickness/2,
-            rotation=self.rotation - math.pi/2
-        )
-        base_left = self.starting_point.transform(
-            dist=self.base_thickness/2,
-            rotation=self.rotation + math.pi/2
+        # flatten per-branch state into parallel arrays so the trig and
+        # corner-point math runs once over the whole tree instead of once
+        # per branch
+        params = []
+        stack = [self]
+        while stack:
+            branch = stack.pop()
+            branch._collect_params(params)
+            stack.extend(branch.children)
+        sx, sy, rot, length, base_t, mid_t, end_t, depth = (
+            np.asarray(column, dtype=np.float64) for column in zip(*params)
         )
 
-        mid_point = self.starting_point.transform(dist=self.length/2, rotation=self.rotation)
-        mid_left = mid_point.transform(
-            dist=self.mid_thickness/2,
-            rotation=self.rotation + math.pi/2
+        cs = np.cos(rot)
+        sn = np.sin(rot)
+        # cos(r -/+ pi/2) = +/-sin(r) and sin(r -/+ pi/2) = -/+cos(r), so the
+        # perpendicular directions cost four negations instead of four trig passes
+        rite_cs = sn
+        rite_sn = -cs
+        left_cs = -sn
+        left_sn = cs
+
+        end_x = sx + length * cs
+        end_y = sy + length * sn
+        mid_x = sx + length/2 * cs
+        mid_y = sy + length/2 * sn
+
+        base_rite_x = sx + base_t/2 * rite_cs
+        base_rite_y = sy + base_t/2 * rite_sn
+        base_left_x = sx + base_t/2 * left_cs
+        base_left_y = sy + base_t/2 * left_sn
+        mid_rite_x = mid_x + mid_t/2 * rite_cs
+        mid_rite_y = mid_y + mid_t/2 * rite_sn
+        mid_left_x = mid_x + mid_t/2 * left_cs
+        mid_left_y = mid_y + mid_t/2 * left_sn
+        tail_rite_x = end_x + end_t/2 * rite_cs
+        tail_rite_y = end_y + end_t/2 * rite_sn
+        tail_left_x = end_x + end_t/2 * left_cs
+        tail_left_y = end_y + end_t/2 * left_sn
+
+        # depths cluster into a narrow band, so quantizing them lets every
+        # branch share one precomputed color tuple per depth step instead of
+        # shading each branch individually
+        quantized = np.rint(depth / _COLOR_DEPTH_STEP).astype(np.int64)
+        branch_color = self.config.branch_color
+        color_lut = {
+            step: branch_color.change_magnitude(step * _COLOR_DEPTH_STEP).to_tuple()
+            for step in np.unique(quantized)
+        }
+
+        base_rite = np.stack([base_rite_x, base_rite_y], axis=1)
+        base_left = np.stack([base_left_x, base_left_y], axis=1)
+        mid_rite = np.stack([mid_rite_x, mid_rite_y], axis=1)
+        mid_left = np.stack([mid_left_x, mid_left_y], axis=1)
+        tail_rite = np.stack([tail_rite_x, tail_rite_y], axis=1)
+        tail_left = np.stack([tail_left_x, tail_left_y], axis=1)
+
+        # curve each side through its mid point with a quadratic Bezier: the
+        # control point 2*mid - (p0 + p2)/2 makes the curve pass through mid
+        # at t=0.5, with no trig and no singularity for vertical branches
+        ts = np.linspace(0, 1, self.config.curve_resolution + 1)[1:-1]
+        left_curve = sample_bezier_between(
+            base_left, 2 * mid_left - (base_left + tail_left) / 2, tail_left, ts
         )
-        mid_rite = mid_point.transform(
-            dist=self.mid_thickness/2,
-            rotation=self.rotation - math.pi/2
+        rite_curve = sample_bezier_between(
+            tail_rite, 2 * mid_rite - (tail_rite + base_rite) / 2, base_rite, ts
         )
 
-        tail_left = self.end_point.transform(
-            dist=self.end_thickness/2,
-            rotation=self.rotation + math.pi/2
-        )
-        tail_rite = self.end_point.transform(
-            dist=self.end_thickness/2,
-            rotation=self.rotation - math.pi/2
-        )
+        # write all vertices into one contiguous float32 buffer; each branch's
+        # polygon is a row slice, so no per-branch arrays are allocated
+        num_curve = len(ts)
+        polygons = np.empty((len(params), 4 + 2 * num_curve, 2), dtype=np.float32)
+        polygons[:, 0] = base_rite
+        polygons[:, 1] = base_left
+        polygons[:, 2:2 + num_curve] = left_curve
+        polygons[:, 2 + num_curve] = tail_left
+        polygons[:, 3 + num_curve] = tail_rite
+        polygons[:, 4 + num_curve:] = rite_curve
 
-        left_circle = Circle.from_3_points(base_left, mid_left, tail_left)
-        rite_circle = Circle.from_3_points(tail_rite, mid_rite, base_rite)
-
-        polygon_points = [
-            base_rite.to_tuple(),
-            base_left.to_tuple(),
-            *left_circle.sample_points_between(base_left, tail_left, self.config.curve_resolution),
-            tail_left.to_tuple(),
-            tail_rite.to_tuple(),
-            *rite_circle.sample_points_between(tail_rite, base_rite, self.config.curve_resolution),
-        ]
-        pygame.draw.polygon(
-            surface,
-            self.config.branch_color.change_magnitude(self.depth).to_tuple(),
-            polygon_points
-        )
+        # draw branches in the back first, then work way up to front
+        order = np.argsort(-depth, kind="stable")
 
-    def _recurse(self):
-        """Create child branches.
+        color_tuples = [color_lut[step] for step in quantized]
+        return [(color_tuples[i], polygons[i].tolist(), 0) for i in order]
+
+    def _reset(self, base_thickness, length, starting_point, rotation, config, depth):
+        self.base_thickness = base_thickness
+        self.length = length
+        self.starting_point = starting_point
+        self.rotation = rotation
+        self.config = config
+        self.depth = depth
+
+        # precomputed values
+        self.end_thickness = base_thickness * config.thickness_decay
+        self.mid_thickness = self.end_thickness * config.mid_thickness_multiplier
+        self.end_point = self.starting_point.transform(dist=length, rotation=rotation)
+
+        # cached draw list; rebuilt lazily on the next render
+        self._draw_list = None
+
+    def _collect_params(self, params):
+        """Appends this branch's geometry inputs to the shared parameter rows.
         """
-        assert not self.children
-        num_children = random.randint(*self.config.num_child_range)
-        for child in range(num_children):
-            child_thickness = self.end_thickness
-            child_length = self.length * rand_sample_between(
-                *self.config.child_length_decay
-            )
-            if child_thickness > self.config.min_thickness and child_length > self.config.min_length:
-                child = Branch(
-                    base_thickness=child_thickness,
-                    length=child_length,
-                    starting_point=self.end_point,
-                    rotation=rand_sample_between(*self.config.rotation_range) + self.rotation,
-                    config=self.config,
-                    depth=rand_sample_between(*self.config.depth_range) + self.depth
-                )
-                self.children.append(child)
+        params.append((
+            self.starting_point.x,
+            self.starting_point.y,
+            self.rotation,
+            self.length,
+            self.base_thickness,
+            self.mid_thickness,
+            self.end_thickness,
+            self.depth
+        ))
 
 
 def main():
-    import time
-    #random.seed(1337)
+    #random.seed(1337); seed_tree_rng(1337)
 
     screen_width = 1200
     screen_height = 800
@@ -249,31 +418,25 @@ def main():
         depth_range=(-0.15, 0.15),
         curve_resolution=20
     )
-    root = Branch(
+    # grow upward from the bottom edge in screen coordinates, so the tree
+    # renders straight onto the display with no flip or intermediate surface
+    root = Branch.grow(
         base_thickness=20,
         length=100,
-        starting_point=Point(x=int(screen_width/2), y=0),
-        rotation=math.pi/2,
+        starting_point=Point(x=int(screen_width/2), y=screen_height),
+        rotation=-math.pi/2,
         config=config
     )
 
-    # render the tree on a surface the size of the display
-    surface = pygame.Surface((screen_width, screen_height))
-    root.render(surface)
-    upsided_surface = pygame.transform.flip(surface, False, True)
-
-    # draw the surface onto the display
+    # nothing animates, so vsync would only add latency and wakeups
+    os.environ['SDL_RENDER_VSYNC'] = '0'
     screen = pygame.display.set_mode((screen_width, screen_height))
-    screen.blit(upsided_surface, (0, 0))
+    root.render(screen)
     pygame.display.flip()
 
-    running = True
-    while running:
-        for evt in pygame.event.get():
-            if evt.type == pygame.QUIT:
-                running = False
-
-        time.sleep(0.01)
+    # block on the OS event queue instead of polling on a timer
+    while pygame.event.wait().type != pygame.QUIT:
+        pass
 
 
 if __name__ == "__main__":